@@ -0,0 +1,94 @@
+"""
+Streamlit caches for the embedding model, vector stores and compliance results
+
+Not yet called by an entry point; main.py still builds a PDFProcessor directly.
+"""
+
+import os
+import time
+import uuid
+import shutil
+import hashlib
+from typing import Any, Dict
+import streamlit as st
+from langchain.vectorstores import FAISS
+from langchain.embeddings.base import Embeddings
+from src.embeddings import create_embeddings
+from src.pdf_processor import PDFProcessor
+from src.compliance_checker import ComplianceChecker
+
+VECTOR_STORE_CACHE_DIR = ".vs_cache"
+
+# Temporary save directories older than this are treated as left behind by a crashed save
+STALE_SAVE_SECONDS = 3600
+
+# Upper bound on vector stores and checkers held in server memory at once
+MAX_CACHED_PDFS = 8
+
+class _ErroredResults(Exception):
+    """Carries results out of the cached check so runs with errored rules are not memoized"""
+    
+    def __init__(self, results: Dict[str, Dict[str, Any]]):
+        super().__init__("Compliance check returned errors")
+        self.results = results
+
+@st.cache_resource(show_spinner=False)
+def load_embeddings() -> Embeddings:
+    """Load the embedding model once per server process"""
+    return create_embeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+def pdf_digest(pdf_bytes: bytes) -> str:
+    """Content hash used to key cached vector stores and results for an uploaded PDF"""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+@st.cache_resource(show_spinner=False, max_entries=MAX_CACHED_PDFS)
+def build_vector_store(pdf_bytes: bytes) -> FAISS:
+    """Load the vector store for an uploaded PDF from disk, building and saving it on first use"""
+    processor = PDFProcessor(embeddings=load_embeddings())
+    cache_path = os.path.join(VECTOR_STORE_CACHE_DIR, f"{pdf_digest(pdf_bytes)}-{processor.cache_tag()}")
+    if os.path.isdir(cache_path):
+        return processor.load_vector_store(cache_path)
+    
+    _remove_stale_saves()
+    vector_store = processor.process_pdf(pdf_bytes)
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}-{uuid.uuid4().hex}"
+    vector_store.save_local(tmp_path)
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        # Another process saved the same store first; its copy is equivalent to ours
+        if not os.path.isdir(cache_path):
+            raise
+    return vector_store
+
+def _remove_stale_saves() -> None:
+    """Delete temporary store directories left behind by saves that crashed"""
+    if not os.path.isdir(VECTOR_STORE_CACHE_DIR):
+        return
+    cutoff = time.time() - STALE_SAVE_SECONDS
+    for entry in os.scandir(VECTOR_STORE_CACHE_DIR):
+        if ".tmp-" in entry.name and entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+@st.cache_resource(show_spinner=False, max_entries=MAX_CACHED_PDFS)
+def get_checker(pdf_hash: str, api_key: str, _vector_store: FAISS) -> ComplianceChecker:
+    """Create the compliance checker once per PDF and API key"""
+    return ComplianceChecker(_vector_store, api_key)
+
+@st.cache_data(show_spinner=False)
+def _check_compliance(pdf_hash: str, rules: Dict[str, Dict], api_key: str,
+                      _vector_store: FAISS) -> Dict[str, Dict[str, Any]]:
+    """Run the compliance check, raising instead of returning when any rule errored"""
+    results = get_checker(pdf_hash, api_key, _vector_store).check_rules_parallel(rules)
+    if any(result['compliance_status'] == "Error" for result in results.values()):
+        raise _ErroredResults(results)
+    return results
+
+def check_compliance(pdf_hash: str, rules: Dict[str, Dict], api_key: str,
+                     _vector_store: FAISS) -> Dict[str, Dict[str, Any]]:
+    """Run the compliance check, cached on the PDF hash and rule set unless a rule errored"""
+    try:
+        return _check_compliance(pdf_hash, rules, api_key, _vector_store)
+    except _ErroredResults as e:
+        return e.results
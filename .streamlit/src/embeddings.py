@@ -0,0 +1,98 @@
+"""
+Quantized sentence embeddings for the vector store pipeline
+"""
+
+import os
+import logging
+from typing import List, Optional
+import numpy as np
+import torch
+import onnxruntime as ort
+from transformers import AutoTokenizer
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
+
+logger = logging.getLogger(__name__)
+
+def create_embeddings(model_name: str = "sentence-transformers/all-MiniLM-L6-v2") -> Embeddings:
+    """Use FP16 sentence-transformers on a CUDA GPU when available, else the int8 ONNX model on CPU"""
+    if torch.cuda.is_available():
+        logger.info(f"Loading {model_name} in FP16 on CUDA")
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": "cuda"},
+            encode_kwargs={"batch_size": 64, "normalize_embeddings": True}
+        )
+        embeddings.client.half()
+        return embeddings
+    
+    return QuantizedMiniLMEmbeddings(model_name=model_name)
+
+class QuantizedMiniLMEmbeddings(Embeddings):
+    """MiniLM sentence embeddings served from an int8-quantized ONNX export"""
+    
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 cache_dir: str = "./onnx_cache", batch_size: int = 64, max_length: int = 256,
+                 num_threads: Optional[int] = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        
+        model_dir = os.path.join(cache_dir, model_name.split("/")[-1])
+        if not os.path.exists(os.path.join(model_dir, "model_quantized.onnx")):
+            self._export_quantized(model_name, model_dir)
+        
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, "model_quantized.onnx"),
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+    
+    def _export_quantized(self, model_name: str, model_dir: str) -> None:
+        """Export the model to ONNX and apply dynamic int8 quantization"""
+        logger.info(f"Exporting quantized ONNX model for {model_name} to {model_dir}")
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+        
+        quantizer = ORTQuantizer.from_pretrained(model)
+        quantizer.quantize(
+            save_dir=model_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        )
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents, batching texts of similar length to limit padding"""
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._embed([texts[i] for i in batch]).tolist()):
+                embeddings[i] = vector
+        return embeddings
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self._embed([text])[0].tolist()
+    
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Run the ONNX model and mean-pool token embeddings into unit vectors"""
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+        
+        mask = encoded["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
@@ -0,0 +1,26 @@
+"""
+PDF page text extraction, kept free of heavy imports so worker processes start quickly
+"""
+
+import io
+import mmap
+from typing import Union
+from pypdf import PdfReader
+
+_worker_reader = None
+
+def open_reader(pdf_source: Union[str, bytes]) -> PdfReader:
+    """Open a PDF from a memory-mapped file path or raw bytes without copying it"""
+    if isinstance(pdf_source, str):
+        with open(pdf_source, "rb") as pdf_file:
+            return PdfReader(mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ))
+    return PdfReader(io.BytesIO(pdf_source))
+
+def init_extract_worker(pdf_source: Union[str, bytes]) -> None:
+    """Open the PDF once in each extraction worker process"""
+    global _worker_reader
+    _worker_reader = open_reader(pdf_source)
+
+def extract_page_text(page_num: int) -> str:
+    """Extract the text of a single page in a worker process"""
+    return _worker_reader.pages[page_num].extract_text()
@@ -3,59 +3,171 @@ PDF ingestion and vector store pipeline
 """
 
 import os
+import hashlib
+import uuid
 import logging
-from typing import List, Optional
-from pypdf import PdfReader
+import itertools
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+import numpy as np
+import faiss
+from langchain.docstore.in_memory import InMemoryDocstore
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
-from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
+from src.embeddings import create_embeddings
+from src.page_extraction import open_reader, init_extract_worker, extract_page_text
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_EXTRACT_WORKERS = 4
+
+# Spawning a worker pool costs about a second, so only very long PDFs are split across processes
+DEFAULT_PARALLEL_MIN_PAGES = 200
+
 class PDFProcessor:
     """Handles PDF processing and vector store creation"""
     
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 hnsw_m: int = 32, hnsw_ef_construction: int = 40, hnsw_ef_search: int = 16,
+                 embeddings: Optional[Embeddings] = None,
+                 extract_workers: Optional[int] = None, parallel_min_pages: int = DEFAULT_PARALLEL_MIN_PAGES,
+                 embed_batch_size: int = 64):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             length_function=len
         )
-        self.embeddings = HuggingFaceEmbeddings(
+        self.embeddings = embeddings or create_embeddings(
             model_name="sentence-transformers/all-MiniLM-L6-v2"
         )
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.extract_workers = extract_workers or min(DEFAULT_EXTRACT_WORKERS, os.cpu_count() or 1)
+        self.parallel_min_pages = parallel_min_pages
+        self.embed_batch_size = embed_batch_size
+    
+    def cache_tag(self) -> str:
+        """Short hash of the index, chunking and embedding settings a saved vector store depends on"""
+        settings = [
+            "IndexHNSWSQ-QT_8bit", self.hnsw_m, self.hnsw_ef_construction,
+            self.chunk_size, self.chunk_overlap,
+            type(self.embeddings).__name__, getattr(self.embeddings, "model_name", "")
+        ]
+        return hashlib.sha256(repr(settings).encode()).hexdigest()[:12]
     
-    def extract_text_from_pdf(self, pdf_path: str) -> List[Document]:
-        """Extract text from PDF file"""
+    def _iter_pages(self, pdf_path: Union[str, bytes, BinaryIO]) -> Iterator[Document]:
+        """Yield a Document for each non-empty page"""
+        source = pdf_path if isinstance(pdf_path, str) else getattr(pdf_path, "name", "uploaded.pdf")
+        pdf_source = pdf_path if isinstance(pdf_path, (str, bytes)) else pdf_path.read()
+        reader = open_reader(pdf_source)
+        total_pages = len(reader.pages)
+        
+        if self.extract_workers > 1 and total_pages >= self.parallel_min_pages:
+            page_texts = self._extract_pages_parallel(pdf_source, total_pages)
+        else:
+            page_texts = (page.extract_text() for page in reader.pages)
+        
+        for page_num, text in enumerate(page_texts):
+            if text.strip():
+                yield Document(
+                    page_content=text,
+                    metadata={
+                        "source": source,
+                        "page": page_num + 1,
+                        "total_pages": total_pages
+                    }
+                )
+    
+    def _extract_pages_parallel(self, pdf_source: Union[str, bytes], total_pages: int) -> Iterator[str]:
+        """Extract page texts across worker processes, yielded in page order"""
+        if isinstance(pdf_source, bytes):
+            # Hand workers a file path to memory-map instead of pickling the whole PDF into each one
+            pdf_file = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+            try:
+                with pdf_file:
+                    pdf_file.write(pdf_source)
+                yield from self._extract_pages_parallel(pdf_file.name, total_pages)
+            finally:
+                os.remove(pdf_file.name)
+            return
+        
+        # Spawn rather than fork: forking a threaded server with live torch/onnxruntime pools can deadlock
+        with ProcessPoolExecutor(
+            max_workers=min(self.extract_workers, total_pages),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_extract_worker,
+            initargs=(pdf_source,)
+        ) as executor:
+            yield from executor.map(extract_page_text, range(total_pages))
+    
+    def extract_text_from_pdf(self, pdf_path: Union[str, bytes, BinaryIO]) -> List[Document]:
+        """Extract text from PDF file path, bytes or binary stream"""
         try:
-            reader = PdfReader(pdf_path)
-            documents = []
-            
-            for page_num, page in enumerate(reader.pages):
-                text = page.extract_text()
-                if text.strip():
-                    documents.append(Document(
-                        page_content=text,
-                        metadata={
-                            "source": pdf_path,
-                            "page": page_num + 1,
-                            "total_pages": len(reader.pages)
-                        }
-                    ))
-            
-            logger.info(f"Extracted {len(documents)} pages from {pdf_path}")
+            documents = list(self._iter_pages(pdf_path))
+            logger.info(f"Extracted {len(documents)} pages from PDF")
             return documents
             
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {e}")
             raise
     
-    def create_vector_store(self, documents: List[Document], save_path: Optional[str] = None) -> FAISS:
+    def process_pdf(self, pdf_path: Union[str, bytes, BinaryIO], save_path: Optional[str] = None) -> FAISS:
+        """Extract, chunk and index a PDF page by page"""
+        return self.create_vector_store(self._iter_pages(pdf_path), save_path)
+    
+    def create_vector_store(self, documents: Iterable[Document], save_path: Optional[str] = None) -> FAISS:
         """Create and optionally save vector store"""
         try:
-            chunks = self.text_splitter.split_documents(documents)
-            vector_store = FAISS.from_documents(chunks, self.embeddings)
+            chunks = (
+                chunk
+                for document in documents
+                for chunk in self.text_splitter.split_documents([document])
+            )
+            index = None
+            docstore = {}
+            index_to_docstore_id = {}
+            vector_for_text: Dict[str, np.ndarray] = {}
+            
+            while True:
+                batch = list(itertools.islice(chunks, self.embed_batch_size))
+                if not batch:
+                    break
+                
+                new_texts = list(dict.fromkeys(
+                    chunk.page_content for chunk in batch if chunk.page_content not in vector_for_text
+                ))
+                if new_texts:
+                    vectors = np.asarray(self.embeddings.embed_documents(new_texts), dtype="float32")
+                    vector_for_text.update(zip(new_texts, vectors))
+                
+                batch_vectors = np.stack([vector_for_text[chunk.page_content] for chunk in batch])
+                if index is None:
+                    index = self._create_index(batch_vectors)
+                index.add(batch_vectors)
+                
+                for chunk in batch:
+                    doc_id = str(uuid.uuid4())
+                    index_to_docstore_id[len(index_to_docstore_id)] = doc_id
+                    docstore[doc_id] = chunk
+            
+            if index is None:
+                raise ValueError("No text chunks to index")
+            index.hnsw.efSearch = self.hnsw_ef_search
+            logger.info(f"Embedded {len(vector_for_text)} unique chunks out of {len(docstore)}")
+            
+            vector_store = FAISS(
+                embedding_function=self.embeddings,
+                index=index,
+                docstore=InMemoryDocstore(docstore),
+                index_to_docstore_id=index_to_docstore_id
+            )
             
             if save_path:
                 vector_store.save_local(save_path)
@@ -67,10 +179,23 @@ class PDFProcessor:
             logger.error(f"Error creating vector store: {e}")
             raise
     
+    def _create_index(self, sample: np.ndarray) -> faiss.Index:
+        """Create an HNSW index over int8 scalar-quantized vectors, trained on the first batch"""
+        index = faiss.IndexHNSWSQ(sample.shape[1], faiss.ScalarQuantizer.QT_8bit, self.hnsw_m)
+        index.hnsw.efConstruction = self.hnsw_ef_construction
+        # Widen the per-dimension ranges so later batches are not clipped to the sample's min/max
+        faiss.downcast_index(index.storage).sq.rangestat_arg = 0.5
+        index.train(sample)
+        return index
+    
     def load_vector_store(self, load_path: str) -> FAISS:
         """Load existing vector store"""
         try:
-            vector_store = FAISS.load_local(load_path, self.embeddings)
+            try:
+                vector_store = FAISS.load_local(load_path, self.embeddings, allow_dangerous_deserialization=True)
+            except TypeError:
+                # langchain releases before the pickle opt-in flag reject the keyword
+                vector_store = FAISS.load_local(load_path, self.embeddings)
             logger.info(f"Vector store loaded from {load_path}")
             return vector_store
         except Exception as e:
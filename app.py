@@ -2,8 +2,7 @@ import streamlit as st
 import json
 import tempfile
 import os
-from pypdf import PdfReader
-import google.generativeai as genai
+import threading
 
 # App configuration
 st.set_page_config(
@@ -12,6 +11,12 @@ st.set_page_config(
     layout="wide"
 )
 
+# Contract characters sent to the model; pages past this budget are not parsed
+MAX_CONTRACT_CHARS = 10000
+
+# genai.configure is process-global, so models bind their client under this lock
+_configure_lock = threading.Lock()
+
 # Simple rules definition
 COMPLIANCE_RULES = [
     {
@@ -51,33 +56,57 @@ COMPLIANCE_RULES = [
     }
 ]
 
-def extract_pdf_text(uploaded_file):
-    """Extract text from PDF file"""
+@st.cache_data(show_spinner=False)
+def _extract_text(pdf_bytes, max_chars):
+    """Extract text from PDF bytes up to max_chars, memoized on the file content"""
+    import fitz
+    
+    parts = []
+    length = 0
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+        for page in pdf_doc:
+            page_text = page.get_text("text")
+            parts.append(page_text)
+            length += len(page_text)
+            if max_chars and length >= max_chars:
+                break
+    return "\n".join(parts).strip()
+
+def extract_pdf_text(uploaded_file, max_chars=MAX_CONTRACT_CHARS):
+    """Extract text from PDF file, stopping once max_chars have been read"""
     try:
-        pdf_reader = PdfReader(uploaded_file)
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        return text.strip()
+        return _extract_text(uploaded_file.getvalue(), max_chars)
     except Exception as e:
         st.error(f"Error reading PDF: {e}")
         return ""
 
-def analyze_compliance(api_key, rule, contract_text):
+@st.cache_resource(show_spinner=False)
+def get_model(api_key, model_name='gemini-2.5-flash-lite'):
+    """Configure the Gemini SDK and create the model once per API key and model"""
+    import google.generativeai as genai
+    from google.generativeai import client
+    
+    with _configure_lock:
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(
+            model_name,
+            generation_config={"response_mime_type": "application/json"}
+        )
+        # Bind this key's client now; the SDK otherwise picks up whichever key was configured last
+        model._client = client.get_default_generative_client()
+    return model
+
+def analyze_compliance(model, rule, contract_text):
     """Analyze compliance for a single rule"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-pro')
-        
         prompt = f"""
-        Analyze this contract text for compliance with this rule:
+        CONTRACT TEXT:
+        {contract_text[:MAX_CONTRACT_CHARS]}
+        
+        ---
+        Analyze the contract text above for compliance with this rule:
         
         RULE: {rule['name']}
         DESCRIPTION: {rule['description']}
         
-        CONTRACT TEXT:
-        {contract_text[:10000]}  # Limit text length
-        
         Answer with ONLY
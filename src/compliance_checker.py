@@ -3,22 +3,98 @@ Custom compliance checker tool connected to Gemini
 """
 
 import os
-import json
-import re
+import hashlib
 import logging
-from typing import List, Dict, Any
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Optional, Tuple
+import numpy as np
+import orjson
+import ahocorasick
 import google.generativeai as genai
+from google.generativeai import client
 from langchain.vectorstores import FAISS
 
 logger = logging.getLogger(__name__)
 
+RULE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rule_id": {"type": "string"},
+        "rule_name": {"type": "string"},
+        "compliance_status": {"type": "string", "enum": ["Compliant", "Non-Compliant", "Partially Compliant"]},
+        "evidence": {"type": "string"},
+        "confidence": {"type": "string", "enum": ["High", "Medium", "Low"]},
+        "remediation": {"type": "string"},
+        "category": {"type": "string"},
+        "severity": {"type": "string"}
+    },
+    "required": ["rule_id", "compliance_status", "evidence", "confidence", "remediation"]
+}
+
+RULE_LIST_SCHEMA = {"type": "array", "items": RULE_SCHEMA}
+
+RESPONSE_CACHE_SIZE = 512
+
+# Completed Gemini responses keyed by API key digest, model, generation config and prompt
+_response_cache: "OrderedDict[str, str]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# genai.configure is process-global, so checkers bind their client under this lock
+_configure_lock = threading.Lock()
+
+class _JsonScanner:
+    """Tracks bracket depth over streamed text to find the span of the first JSON value"""
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.consumed = 0
+        self.start = None
+        self.end = None
+    
+    def feed(self, text: str) -> bool:
+        """Consume more text; returns True once the first top-level JSON value is complete"""
+        for offset, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char in '{[':
+                if self.depth == 0:
+                    self.start = self.consumed + offset
+                self.depth += 1
+            elif char in '}]' and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.consumed + offset + 1
+                    return True
+            elif char == '"' and self.depth:
+                self.in_string = True
+        self.consumed += len(text)
+        return False
+
 class ComplianceChecker:
     """Checks compliance against defined rules using Gemini"""
     
-    def __init__(self, vector_store: FAISS, api_key: str):
+    def __init__(self, vector_store: FAISS, api_key: str, model_name: str = 'gemini-2.5-flash-lite'):
         self.vector_store = vector_store
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        with _configure_lock:
+            genai.configure(api_key=api_key)
+            self.model = genai.GenerativeModel(
+                model_name,
+                generation_config={"response_mime_type": "application/json", "response_schema": RULE_SCHEMA}
+            )
+            # Bind this key's client now; the SDK otherwise picks up whichever key was configured last
+            self.model._client = client.get_default_generative_client()
+        self._api_key_digest = hashlib.sha256(api_key.encode()).hexdigest()
+        self._keyword_hits: Dict[Tuple[str, ...], List[str]] = {}
+        self._prompt_cache: Dict[Tuple[str, ...], Tuple[str, str]] = {}
     
     def retrieve_relevant_sections(self, query: str, k: int = 5) -> List[str]:
         """Retrieve relevant document sections for a query"""
@@ -29,24 +105,180 @@ class ComplianceChecker:
             logger.warning(f"Error in similarity search: {e}")
             return []
     
-    def check_rule_compliance(self, rule_id: str, rule_definition: Dict) -> Dict[str, Any]:
-        """Check compliance for a specific rule"""
-        query = self._build_compliance_query(rule_definition)
-        relevant_sections = self.retrieve_relevant_sections(query)
+    def batch_retrieve(self, queries: List[str], k: int = 5) -> List[List[str]]:
+        """Retrieve relevant document sections for several queries with one index search"""
+        try:
+            vectors = np.asarray(self.vector_store.embedding_function.embed_documents(queries), dtype='float32')
+            if getattr(self.vector_store, '_normalize_L2', False):
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            _, indices = self.vector_store.index.search(vectors, k)
+            
+            docstore = self.vector_store.docstore
+            index_to_id = self.vector_store.index_to_docstore_id
+            return [
+                [docstore.search(index_to_id[i]).page_content for i in row if i != -1]
+                for row in indices
+            ]
+        except Exception as e:
+            logger.warning(f"Error in batch similarity search: {e}")
+            return [[] for _ in queries]
+    
+    def check_rule_compliance(self, rule_id: str, rule_definition: Dict,
+                              relevant_sections: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Check compliance for a specific rule, optionally with pre-fetched sections"""
+        if relevant_sections is None:
+            relevant_sections = self._prefetch_sections({rule_id: rule_definition})[rule_id]
         context = self._build_context(relevant_sections)
         
         prompt = self._build_prompt(rule_id, rule_definition, context)
         
         try:
-            response = self.model.generate_content(prompt)
-            result = self._parse_response(response.text, rule_id, rule_definition)
+            response_text = self._generate(prompt)
+            result = self._parse_response(response_text, rule_id, rule_definition)
             result['relevant_sections'] = relevant_sections
             return result
             
         except Exception as e:
             logger.error(f"Error checking rule {rule_id}: {e}")
+            self._evict_response(prompt)
             return self._create_error_response(rule_id, rule_definition, str(e))
     
+    def check_all_rules(self, rules: Dict[str, Dict]) -> Dict[str, Dict[str, Any]]:
+        """Check compliance for all rules with a single Gemini request"""
+        sections_by_rule = self._prefetch_sections(rules)
+        
+        prompt = self._build_batch_prompt(rules, sections_by_rule)
+        generation_kwargs = {"generation_config": {"response_schema": RULE_LIST_SCHEMA}}
+        
+        parsed = {}
+        error = "No result returned for rule"
+        try:
+            response_text = self._generate(prompt, **generation_kwargs)
+            parsed = self._parse_batch_response(response_text, rules)
+        except Exception as e:
+            logger.error(f"Error checking rules in batch: {e}")
+            error = str(e)
+        
+        # Keep a partial or unparseable batch out of the cache so a rerun asks again
+        if parsed.keys() != rules.keys():
+            self._evict_response(prompt, **generation_kwargs)
+        
+        results = {}
+        for rule_id, rule_definition in rules.items():
+            result = parsed.get(rule_id)
+            if result is None:
+                result = self._create_error_response(rule_id, rule_definition, error)
+            result['relevant_sections'] = sections_by_rule[rule_id]
+            results[rule_id] = result
+        return results
+    
+    def check_rules_parallel(self, rules: Dict[str, Dict], max_workers: int = 8,
+                             progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, Dict[str, Any]]:
+        """Check compliance for each rule with concurrent Gemini requests"""
+        sections_by_rule = self._prefetch_sections(rules)
+        
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(rules)))) as executor:
+            futures = {
+                executor.submit(self.check_rule_compliance, rule_id, rule_definition, sections_by_rule[rule_id]): rule_id
+                for rule_id, rule_definition in rules.items()
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if progress_callback:
+                    progress_callback(len(results), len(rules))
+        
+        return {rule_id: results[rule_id] for rule_id in rules}
+    
+    def _generate(self, prompt: str, **kwargs) -> str:
+        """Stream a Gemini response and return the first complete JSON value in it"""
+        cache_key = self._response_cache_key(prompt, **kwargs)
+        with _response_cache_lock:
+            if cache_key in _response_cache:
+                _response_cache.move_to_end(cache_key)
+                return _response_cache[cache_key]
+        
+        scanner = _JsonScanner()
+        parts = []
+        for chunk in self.model.generate_content(prompt, stream=True, **kwargs):
+            parts.append(chunk.text)
+            if scanner.feed(chunk.text):
+                break
+        
+        text = "".join(parts)
+        if scanner.end is None:
+            return text
+        
+        text = text[scanner.start:scanner.end]
+        with _response_cache_lock:
+            _response_cache[cache_key] = text
+            if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+        return text
+    
+    def _response_cache_key(self, prompt: str, **kwargs) -> str:
+        """Cache key for a response to this prompt from this API key, model and generation config"""
+        return hashlib.sha256(
+            f"{self._api_key_digest}\0{self.model.model_name}\0{orjson.dumps(kwargs, option=orjson.OPT_SORT_KEYS).decode()}\0{prompt}".encode()
+        ).hexdigest()
+    
+    def _evict_response(self, prompt: str, **kwargs) -> None:
+        """Drop a cached response that turned out to be unusable"""
+        with _response_cache_lock:
+            _response_cache.pop(self._response_cache_key(prompt, **kwargs), None)
+    
+    def _prefetch_sections(self, rules: Dict[str, Dict], k: int = 5) -> Dict[str, List[str]]:
+        """Select relevant sections for every rule, searching only where keyword hits fall short"""
+        keyword_hits = self._find_keyword_hits(rules)
+        
+        search_ids = [rule_id for rule_id in rules if len(keyword_hits.get(rule_id, [])) < k]
+        retrieved = {}
+        if search_ids:
+            queries = [self._build_compliance_query(rules[rule_id]) for rule_id in search_ids]
+            retrieved = dict(zip(search_ids, self.batch_retrieve(queries, k)))
+        
+        sections_by_rule = {}
+        for rule_id in rules:
+            sections = list(keyword_hits.get(rule_id, []))[:k]
+            sections += [section for section in retrieved.get(rule_id, []) if section not in sections]
+            sections_by_rule[rule_id] = sections[:k]
+        return sections_by_rule
+    
+    def _find_keyword_hits(self, rules: Dict[str, Dict]) -> Dict[str, List[str]]:
+        """Find distinct chunk texts mentioning each rule's keywords, most mentions first"""
+        cache_keys = {
+            rule_id: (rule_id, *rule_definition['keywords'])
+            for rule_id, rule_definition in rules.items() if rule_definition.get('keywords')
+        }
+        rules_by_keyword: Dict[str, List[str]] = {}
+        for rule_id, cache_key in cache_keys.items():
+            if cache_key not in self._keyword_hits:
+                for keyword in rules[rule_id]['keywords']:
+                    rules_by_keyword.setdefault(keyword.lower(), []).append(rule_id)
+        
+        if rules_by_keyword:
+            automaton = ahocorasick.Automaton()
+            for keyword, rule_ids in rules_by_keyword.items():
+                automaton.add_word(keyword, rule_ids)
+            automaton.make_automaton()
+            
+            scored = {rule_id: [] for rule_ids in rules_by_keyword.values() for rule_id in rule_ids}
+            docstore = self.vector_store.docstore
+            for doc_id in self.vector_store.index_to_docstore_id.values():
+                text = docstore.search(doc_id).page_content
+                mentions: Dict[str, int] = {}
+                for _, rule_ids in automaton.iter(text.lower()):
+                    for rule_id in rule_ids:
+                        mentions[rule_id] = mentions.get(rule_id, 0) + 1
+                for rule_id, count in mentions.items():
+                    scored[rule_id].append((count, text))
+            
+            for rule_id, hits in scored.items():
+                hits.sort(key=lambda hit: hit[0], reverse=True)
+                self._keyword_hits[cache_keys[rule_id]] = list(dict.fromkeys(text for _, text in hits))
+        
+        return {rule_id: self._keyword_hits[cache_key] for rule_id, cache_key in cache_keys.items()}
+    
     def _build_compliance_query(self, rule_definition: Dict) -> str:
         """Build query for retrieving relevant sections"""
         return f"{rule_definition['description']} What specific clauses or language addresses this requirement?"
@@ -57,7 +289,17 @@ class ComplianceChecker:
     
     def _build_prompt(self, rule_id: str, rule_definition: Dict, context: str) -> str:
         """Build prompt for Gemini"""
-        return f"""
+        prefix, suffix = self._prompt_parts(rule_id, rule_definition)
+        return prefix + context + suffix
+    
+    def _prompt_parts(self, rule_id: str, rule_definition: Dict) -> Tuple[str, str]:
+        """Rule-specific text before and after the context, built once per rule definition"""
+        cache_key = (
+            rule_id, rule_definition['name'], rule_definition['description'],
+            rule_definition['category'], rule_definition['severity']
+        )
+        if cache_key not in self._prompt_cache:
+            prefix = f"""
         Analyze the contract sections and determine compliance with this rule:
         
         RULE: {rule_definition['name']}
@@ -66,7 +308,8 @@ class ComplianceChecker:
         SEVERITY: {rule_definition['severity']}
         
         CONTRACT SECTIONS:
-        {context}
+        """
+            suffix = f"""
         
         Provide JSON response with:
         - compliance_status: [Compliant/Non-Compliant/Partially Compliant]
@@ -85,20 +328,78 @@ class ComplianceChecker:
             "severity": "{rule_definition['severity']}"
         }}
         """
+            self._prompt_cache[cache_key] = (prefix, suffix)
+        return self._prompt_cache[cache_key]
+    
+    def _build_batch_prompt(self, rules: Dict[str, Dict], sections_by_rule: Dict[str, List[str]]) -> str:
+        """Build a single prompt covering every rule"""
+        blocks = []
+        for i, (rule_id, rule_definition) in enumerate(rules.items(), 1):
+            context = self._build_context(sections_by_rule[rule_id])
+            blocks.append(
+                f"## RULE {i}: {rule_definition['name']}\n"
+                f"RULE_ID: {rule_id}\n"
+                f"DESCRIPTION: {rule_definition['description']}\n"
+                f"CATEGORY: {rule_definition['category']}\n"
+                f"SEVERITY: {rule_definition['severity']}\n"
+                f"CONTEXT:\n{context}"
+            )
+        rule_blocks = "\n\n".join(blocks)
+        
+        return f"""
+        Analyze the contract sections below and determine compliance with each rule.
+        Each rule is followed by the contract sections relevant to it.
+        
+        {rule_blocks}
+        
+        Provide a JSON array with one object per rule, in the same order, each with:
+        - rule_id: the RULE_ID given above
+        - compliance_status: [Compliant/Non-Compliant/Partially Compliant]
+        - evidence: specific text supporting assessment
+        - confidence: [High/Medium/Low]
+        - remediation: steps to fix if non-compliant
+        
+        [
+            {{
+                "rule_id": "rule id",
+                "rule_name": "rule name",
+                "compliance_status": "status",
+                "evidence": "text evidence",
+                "confidence": "confidence level",
+                "remediation": "remediation steps",
+                "category": "category",
+                "severity": "severity"
+            }}
+        ]
+        """
+    
+    def _parse_batch_response(self, response_text: str, rules: Dict[str, Dict]) -> Dict[str, Dict[str, Any]]:
+        """Parse a batched Gemini response into results keyed by rule id"""
+        try:
+            items = orjson.loads(response_text)
+            return {
+                item['rule_id']: {**item, **self._rule_fields(item['rule_id'], rules[item['rule_id']])}
+                for item in items if isinstance(item, dict) and item.get('rule_id') in rules
+            }
+        except Exception as e:
+            raise ValueError(f"Failed to parse response: {e}")
     
     def _parse_response(self, response_text: str, rule_id: str, rule_definition: Dict) -> Dict[str, Any]:
         """Parse Gemini response"""
         try:
-            json_match = re.search(r'\{[^{}]*\{.*\}[^{}]*\}|\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                result_text = json_match.group()
-                result_text = result_text.replace('```json', '').replace('```', '').strip()
-                return json.loads(result_text)
-            else:
-                raise ValueError("No JSON found in response")
+            return {**orjson.loads(response_text), **self._rule_fields(rule_id, rule_definition)}
         except Exception as e:
             raise ValueError(f"Failed to parse response: {e}")
     
+    def _rule_fields(self, rule_id: str, rule_definition: Dict) -> Dict[str, Any]:
+        """Authoritative rule metadata, applied over whatever the model echoes back"""
+        return {
+            "rule_id": rule_id,
+            "rule_name": rule_definition['name'],
+            "category": rule_definition['category'],
+            "severity": rule_definition['severity']
+        }
+    
     def _create_error_response(self, rule_id: str, rule_definition: Dict, error: str) -> Dict[str, Any]:
         """Create error response"""
         return {